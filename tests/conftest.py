@@ -0,0 +1,70 @@
+"""
+conftest.py — Shared fixtures for the pipeline test suite.
+
+Also puts tools/ on sys.path once, before any test module is collected.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent / "tools"
+sys.path.insert(0, str(TOOLS_DIR))
+
+
+# =========================================================================
+# Timing
+# =========================================================================
+
+@pytest.fixture(autouse=True)
+def _no_sleep(monkeypatch):
+    """Never wait out POST_DELAY / poll intervals for real during tests."""
+    monkeypatch.setattr("execute_posting_plan.time.sleep", lambda *_: None)
+
+
+# =========================================================================
+# Videos
+# =========================================================================
+
+@pytest.fixture(scope="session")
+def fake_video_dir(tmp_path_factory):
+    """One shared videos/ folder: 10 fake .mp4 files plus a .txt and a .jpg."""
+    directory = tmp_path_factory.mktemp("videos")
+    for name in [f"v{i}.mp4" for i in range(10)]:
+        (directory / name).write_bytes(b"\x00" * 1024)  # 1KB dummy file
+    (directory / "notes.txt").write_text("hello")
+    (directory / "thumb.jpg").write_bytes(b"\xff\xd8")
+    return directory
+
+
+# =========================================================================
+# Credentials
+# =========================================================================
+
+@pytest.fixture
+def no_instagram_creds(monkeypatch):
+    """Blank Instagram credentials so post_reel returns before any HTTP call."""
+    monkeypatch.setattr("post_instagram.INSTAGRAM_USER_ID", "")
+    monkeypatch.setattr("post_instagram.INSTAGRAM_ACCESS_TOKEN", "")
+
+
+@pytest.fixture
+def no_tiktok_creds(monkeypatch):
+    """Blank TikTok credentials so post_video returns before any HTTP call."""
+    monkeypatch.setattr("post_tiktok.TIKTOK_ACCESS_TOKEN", "")
+
+
+@pytest.fixture
+def no_facebook_creds(monkeypatch):
+    """Blank Facebook credentials so post_reel returns before any HTTP call."""
+    monkeypatch.setattr("post_facebook.FACEBOOK_PAGE_ID", "")
+    monkeypatch.setattr("post_facebook.FACEBOOK_PAGE_ACCESS_TOKEN", "")
+
+
+@pytest.fixture
+def no_platform_creds(monkeypatch):
+    """Blank every platform token as seen by execute_posting_plan."""
+    monkeypatch.setattr("execute_posting_plan.INSTAGRAM_ACCESS_TOKEN", "")
+    monkeypatch.setattr("execute_posting_plan.TIKTOK_ACCESS_TOKEN", "")
+    monkeypatch.setattr("execute_posting_plan.FACEBOOK_PAGE_ACCESS_TOKEN", "")
@@ -0,0 +1,94 @@
+"""
+_json_common.py — JSON helpers shared by the tools.
+
+Uses orjson when it is installed (C-implemented, serializes straight to UTF-8
+bytes) and falls back to the stdlib with the same output otherwise.
+"""
+
+import json
+import mmap
+import os
+import tempfile
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback: same output, just slower
+    orjson = None
+
+# orjson.JSONDecodeError subclasses this, so one except clause covers both
+JSONDecodeError = json.JSONDecodeError
+
+# read_json parses files at least this big straight from a read-only mapping
+# (orjson takes a memoryview). Smaller files are cheaper to read(): mapping a
+# few KB costs more than the copy it avoids.
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def loads(data: bytes | str):
+    """Parse JSON with orjson when installed, else the stdlib."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps_indented(obj) -> str:
+    """Serialize to 2-space-indented JSON (non-ASCII kept as-is)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+def dumps_line(obj) -> str:
+    """Serialize to compact single-line JSON, for JSON-lines logs."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def read_json(path):
+    """Read and parse a JSON file (bytes in, no str decode step)."""
+    with open(path, "rb") as f:
+        if orjson is None or os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            return loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return orjson.loads(view)
+            finally:
+                view.release()  # the mapping can't close while a view is exported
+
+
+def read_json_lines(path) -> list:
+    """Records from a JSON-lines log, [] if it doesn't exist; a line torn by a crash mid-write is skipped."""
+    if not path.exists():
+        return []
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                records.append(loads(line))
+            except JSONDecodeError:
+                continue
+    return records
+
+
+def _indented_bytes(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def write_json(path, obj):
+    """Write obj as indented UTF-8 JSON."""
+    with open(path, "wb") as f:
+        f.write(_indented_bytes(obj))
+
+
+def write_json_atomic(path, obj):
+    """write_json via a temp file in the same directory + os.replace, so readers never see a torn file."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_indented_bytes(obj))
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
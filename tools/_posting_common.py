@@ -0,0 +1,73 @@
+"""
+_posting_common.py — Shared HTTP and caption helpers for the post_*.py platform tools.
+
+Each poster keeps one module-level session from build_session() so every call
+to a platform (init, upload, status polls, publish) reuses the same keep-alive
+connection instead of paying a new TCP/TLS handshake per request.
+
+HTTP/1.1 keep-alive is enough here: the platforms live on separate hosts, so
+nothing is shared across them, and at most --parallel requests per host are in
+flight, each on its own pooled connection. HTTP/2 multiplexing would add a
+dependency without saving any handshakes.
+"""
+
+import mmap
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POLL_MAX_INTERVAL = 15  # cap (seconds) for the exponential status-poll backoff
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB per read/send when streaming a video upload
+
+
+def build_session() -> requests.Session:
+    """Create a keep-alive session that retries throttled/5xx idempotent requests."""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # Only reads are replayed; uploads (PUT/POST with a streamed body) and
+        # publish calls must never be sent twice.
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        # Hand the final response back to the caller's status checks instead of raising
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+def poll_delay(attempt: int) -> float:
+    """Seconds to wait before status poll number `attempt` (0-based): 1, 2, 4, 8, 15, 15..."""
+    return min(POLL_MAX_INTERVAL, 2 ** attempt)
+
+
+class FileChunks:
+    """
+    Request body that streams a file in UPLOAD_CHUNK_SIZE slices of an mmap.
+
+    Reads a megabyte per step instead of requests' default 8-16 KB file reads.
+    Defines __len__ so requests sends a Content-Length header rather than
+    switching to chunked transfer encoding, which the upload endpoints reject.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        if not self.size:
+            return  # mmap can't map an empty file
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in range(0, len(mm), UPLOAD_CHUNK_SIZE):
+                yield mm[offset:offset + UPLOAD_CHUNK_SIZE]
+
+
+def format_tags(hashtags: list[str]) -> str:
+    """Space-separated hashtags, adding the leading # only where it is missing."""
+    return " ".join(t if t.startswith("#") else "#" + t for t in hashtags)
@@ -5,6 +5,7 @@ Loads .env and brand_config.json, exposes all settings as module-level constants
 Every other tool imports from here.
 """
 
+import functools
 import json
 import os
 from pathlib import Path
@@ -29,6 +30,11 @@ BRAND_CONFIG_PATH = BASE_DIR / "brand_config.json"
 # OpenAI
 # ---------------------------------------------------------------------------
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+POSTING_PLAN_MODEL = os.getenv("POSTING_PLAN_MODEL", "gpt-4o-mini")
+
+# Set PLAN_CACHE=1 to reuse a stored completion when the prompt is unchanged
+PLAN_CACHE = os.getenv("PLAN_CACHE", "") == "1"
+PLAN_CACHE_DIR = TMP_DIR / "plan_cache"
 
 # ---------------------------------------------------------------------------
 # AWS S3
@@ -38,6 +44,10 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "")
 AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET", "")
 AWS_S3_REGION = os.getenv("AWS_S3_REGION", "us-east-1")
 
+# Set AWS_S3_ACCELERATE=1 to upload through S3 Transfer Acceleration (the bucket
+# must have it enabled); helps when uploading from far away from the region
+AWS_S3_ACCELERATE = os.getenv("AWS_S3_ACCELERATE", "") == "1"
+
 # ---------------------------------------------------------------------------
 # Instagram (Meta Graph API)
 # ---------------------------------------------------------------------------
@@ -61,15 +71,26 @@ TIKTOK_ACCESS_TOKEN = os.getenv("TIKTOK_ACCESS_TOKEN", "")
 # Brand Config
 # ---------------------------------------------------------------------------
 
+@functools.lru_cache(maxsize=8)
+def _load_brand_config(path_str: str, mtime_ns: int) -> dict:
+    """Parse brand_config.json. Cached per (path, mtime) so edits are picked up."""
+    return json.loads(Path(path_str).read_bytes())
+
+
 def load_brand_config() -> dict:
-    """Load brand_config.json. Returns empty-ish defaults if file is missing."""
-    if not BRAND_CONFIG_PATH.exists():
+    """Load brand_config.json. Raises FileNotFoundError if the file is missing."""
+    try:
+        mtime_ns = BRAND_CONFIG_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
         raise FileNotFoundError(
             f"brand_config.json not found at {BRAND_CONFIG_PATH}. "
             "Copy the template and fill in your brand details."
-        )
-    with open(BRAND_CONFIG_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+        ) from None
+    # Return a copy so callers can't mutate the cached dict
+    return dict(_load_brand_config(str(BRAND_CONFIG_PATH), mtime_ns))
+
+
+load_brand_config.cache_clear = _load_brand_config.cache_clear
 
 
 # Video file extensions to scan
@@ -2,21 +2,32 @@
 execute_posting_plan.py — Read the posting plan and post each entry to the correct platform.
 
 Reads .tmp/posting_plan.json, .tmp/video_urls.json, and .tmp/video_metadata.json,
-then posts each scheduled entry to Instagram, TikTok, or Facebook.
-
-Supports --dry-run to preview without posting, and resumes after partial failure
-by skipping entries already in .tmp/posting_results.json.
+then posts each scheduled entry to Instagram, TikTok, or Facebook. The three
+platforms post concurrently (one worker each); entries for the same platform start
+in schedule order, each POST_DELAY seconds after a post finishes and frees its
+slot. --parallel=K lets up to K posts per
+platform be in flight at once (default 1, capped per platform by
+PLATFORM_MAX_IN_FLIGHT), so slow uploads/processing polls overlap.
+
+Supports --dry-run to preview the full schedule without posting, and resumes after partial failure
+by skipping entries already in .tmp/posting_results.json. Each result is appended
+to .tmp/posting_results.jsonl as it happens; the .json file is rewritten once at
+the end of the run.
 
 Usage:
     python tools/execute_posting_plan.py              # post everything
     python tools/execute_posting_plan.py --dry-run    # preview only
+    python tools/execute_posting_plan.py --parallel=3 # up to 3 posts in flight per platform
 """
 
-import json
+import queue
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from _json_common import dumps_line, read_json, read_json_lines, write_json_atomic
 from config import (
     TMP_DIR, VIDEOS_DIR,
     INSTAGRAM_ACCESS_TOKEN, FACEBOOK_PAGE_ACCESS_TOKEN, TIKTOK_ACCESS_TOKEN,
@@ -25,7 +36,12 @@ from post_instagram import post_reel as ig_post_reel
 from post_tiktok import post_video as tt_post_video
 from post_facebook import post_reel as fb_post_reel
 
-POST_DELAY = 30  # seconds between posts
+POST_DELAY = 30  # seconds between posts to the same platform
+
+# Ceiling on --parallel per platform. Each in-flight post holds an open upload or
+# processing container on that platform's API; TikTok is the tightest, with
+# per-user limits on video init calls.
+PLATFORM_MAX_IN_FLIGHT = {"instagram": 4, "tiktok": 2, "facebook": 4}
 
 
 def load_json(path):
@@ -33,16 +49,12 @@ def load_json(path):
     if not path.exists():
         print(f"ERROR: {path} not found.")
         sys.exit(1)
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return read_json(path)
 
 
-def get_item_content(items: list, video_id: str, platform: str) -> dict | None:
+def get_item_content(items_by_id: dict, video_id: str, platform: str) -> dict | None:
     """Look up the caption/hashtags for a video_id + platform combo."""
-    for item in items:
-        if item["video_id"] == video_id:
-            return item.get(platform)
-    return None
+    return items_by_id.get(video_id, {}).get(platform)
 
 
 def check_credentials() -> list[str]:
@@ -57,8 +69,96 @@ def check_credentials() -> list[str]:
     return available
 
 
+def post_entry(job: dict) -> dict:
+    """Post one scheduled entry to its platform and return the result record to log."""
+    platform = job["platform"]
+    caption = job["caption"]
+    hashtags = job["hashtags"]
+    video_path = job["video_path"]
+
+    result = None
+    if platform == "instagram":
+        if not job["s3_url"]:
+            result = {"success": False, "platform": "instagram",
+                      "error": "No S3 URL — run upload_to_s3.py first"}
+        else:
+            result = ig_post_reel(job["s3_url"], caption, hashtags)
+    elif platform == "tiktok":
+        if not video_path:
+            result = {"success": False, "platform": "tiktok",
+                      "error": "No video file path"}
+        else:
+            result = tt_post_video(video_path, caption, hashtags)
+    elif platform == "facebook":
+        if not video_path:
+            result = {"success": False, "platform": "facebook",
+                      "error": "No video file path"}
+        else:
+            result = fb_post_reel(video_path, caption, hashtags)
+
+    result_entry = {
+        "video_id": job["video_id"],
+        "platform": platform,
+        "success": result["success"],
+        "posted_at": datetime.now().isoformat(timespec="seconds"),
+        "error": result.get("error"),
+        # Copy platform-specific IDs
+        **{key: result[key] for key in ("media_id", "publish_id") if key in result},
+    }
+    if platform == "facebook" and "video_id" in result:
+        result_entry["fb_video_id"] = result["video_id"]
+    return result_entry
+
+
+def post_platform(jobs: list[dict], done: queue.Queue, max_in_flight: int = 1):
+    """
+    Worker: post one platform's entries in schedule order.
+
+    At most max_in_flight posts may be uploading/processing at once. Each post
+    after the first waits for a free slot and then POST_DELAY, so with 1 slot
+    there is a full POST_DELAY gap after every post finishes; with more, starts
+    are still at least POST_DELAY apart.
+    Puts (job, result_entry) on `done` after each post, then None when finished.
+    """
+    slots = threading.Semaphore(max_in_flight)
+
+    def run(job):
+        try:
+            done.put((job, post_entry(job)))
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            futures = []
+            for j, job in enumerate(jobs):
+                # The cooldown starts once a slot is free, i.e. after a post finished
+                slots.acquire()
+                if j:
+                    time.sleep(POST_DELAY)
+                print(f"  {job['label']} Posting {job['video_id']} → {job['platform']}...", flush=True)
+                futures.append(pool.submit(run, job))
+        for future in futures:
+            future.result()
+    finally:
+        done.put(None)
+
+
+def parse_parallel(argv: list[str]) -> int:
+    """Read --parallel=K (max posts in flight per platform). Defaults to 1."""
+    for arg in argv:
+        if arg.startswith("--parallel="):
+            value = arg.split("=", 1)[1]
+            if not value.isdigit() or int(value) < 1:
+                print(f"ERROR: --parallel expects a positive integer, got '{value}'")
+                sys.exit(1)
+            return int(value)
+    return 1
+
+
 def main():
     dry_run = "--dry-run" in sys.argv
+    parallel = parse_parallel(sys.argv[1:])
 
     # Load all data
     plan = load_json(TMP_DIR / "posting_plan.json")
@@ -68,28 +168,32 @@ def main():
     urls_path = TMP_DIR / "video_urls.json"
     video_urls = {}
     if urls_path.exists():
-        with open(urls_path, "r", encoding="utf-8") as f:
-            video_urls = json.load(f)
+        video_urls = read_json(urls_path)
 
     items = plan.get("items", [])
+    items_by_id = {item["video_id"]: item for item in items}
     schedule = plan.get("posting_plan", {}).get("recommended_schedule", [])
 
     if not schedule:
         print("No entries in posting schedule. Nothing to do.")
         sys.exit(0)
 
-    # Load existing results (for resume)
+    # Load existing results (for resume), including any a crashed run only
+    # got as far as appending to the log. A dry run never reads or writes
+    # results, so it skips this entirely and previews the whole schedule.
     results_path = TMP_DIR / "posting_results.json"
+    log_path = results_path.with_suffix(".jsonl")
     existing_results = []
-    if results_path.exists():
-        with open(results_path, "r", encoding="utf-8") as f:
-            existing_results = json.load(f)
+    if not dry_run:
+        if results_path.exists():
+            existing_results = read_json(results_path)
+        existing_results.extend(read_json_lines(log_path))
 
-    # Build set of already-posted entries for skip logic
+    # Build set of already-posted entries for skip logic (malformed entries ignored)
     posted_keys = {
         (r["video_id"], r["platform"])
         for r in existing_results
-        if r.get("success")
+        if r.get("success") and "video_id" in r and "platform" in r
     }
 
     # Check which platforms are configured
@@ -101,44 +205,41 @@ def main():
 
     # Build file_name lookup
     file_lookup = {v["video_id"]: v["file_name"] for v in video_metadata}
+    video_paths = {vid: str(VIDEOS_DIR / fn) if fn else "" for vid, fn in file_lookup.items()}
 
     if dry_run:
         print("=== DRY RUN — no posts will be made ===\n")
     else:
         print(f"Platforms configured: {', '.join(available_platforms)}\n")
 
-    results = list(existing_results)
-    succeeded = 0
-    failed = 0
+    total = len(schedule)
     skipped = 0
+    jobs_by_platform = {}
 
-    for i, entry in enumerate(schedule):
+    for i, entry in enumerate(schedule, start=1):
         vid = entry["video_id"]
         platform = entry["platform"]
         pub_time = entry.get("publish_time_local", "")
 
         # Skip already posted
         if (vid, platform) in posted_keys:
-            print(f"  [{i+1}/{len(schedule)}] SKIP {vid} → {platform} (already posted)")
+            print(f"  [{i}/{total}] SKIP {vid} → {platform} (already posted)")
             skipped += 1
             continue
 
         # Get content
-        content = get_item_content(items, vid, platform)
+        content = get_item_content(items_by_id, vid, platform)
         if not content:
-            print(f"  [{i+1}/{len(schedule)}] SKIP {vid} → {platform} (no content found)")
+            print(f"  [{i}/{total}] SKIP {vid} → {platform} (no content found)")
             skipped += 1
             continue
 
         caption = content.get("caption", "")
         hashtags = content.get("hashtags", [])
-        file_name = file_lookup.get(vid, "")
-        video_path = str(VIDEOS_DIR / file_name) if file_name else ""
-        s3_url = video_urls.get(vid, "")
 
         if dry_run:
-            print(f"  [{i+1}/{len(schedule)}] {vid} → {platform} @ {pub_time}")
-            print(f"    File: {file_name}")
+            print(f"  [{i}/{total}] {vid} → {platform} @ {pub_time}")
+            print(f"    File: {file_lookup.get(vid, '')}")
             print(f"    Caption: {caption[:80]}{'...' if len(caption) > 80 else ''}")
             print(f"    Hashtags: {', '.join(hashtags[:5])}")
             print()
@@ -146,76 +247,75 @@ def main():
 
         # Skip if platform not configured
         if platform not in available_platforms:
-            print(f"  [{i+1}/{len(schedule)}] SKIP {vid} → {platform} (not configured)")
+            print(f"  [{i}/{total}] SKIP {vid} → {platform} (not configured)")
             skipped += 1
             continue
 
-        print(f"  [{i+1}/{len(schedule)}] Posting {vid} → {platform}...", end=" ", flush=True)
-
-        # Post to the correct platform
-        result = None
-        if platform == "instagram":
-            if not s3_url:
-                result = {"success": False, "platform": "instagram",
-                          "error": "No S3 URL — run upload_to_s3.py first"}
-            else:
-                result = ig_post_reel(s3_url, caption, hashtags)
-        elif platform == "tiktok":
-            if not video_path:
-                result = {"success": False, "platform": "tiktok",
-                          "error": "No video file path"}
-            else:
-                result = tt_post_video(video_path, caption, hashtags)
-        elif platform == "facebook":
-            if not video_path:
-                result = {"success": False, "platform": "facebook",
-                          "error": "No video file path"}
-            else:
-                result = fb_post_reel(video_path, caption, hashtags)
-
-        # Log result
-        result_entry = {
+        jobs_by_platform.setdefault(platform, []).append({
+            "label": f"[{i}/{total}]",
             "video_id": vid,
             "platform": platform,
-            "success": result["success"],
-            "posted_at": datetime.now().isoformat(),
-            "error": result.get("error"),
-        }
-        # Copy platform-specific IDs
-        if "media_id" in result:
-            result_entry["media_id"] = result["media_id"]
-        if "publish_id" in result:
-            result_entry["publish_id"] = result["publish_id"]
-        if platform == "facebook" and "video_id" in result:
-            result_entry["fb_video_id"] = result["video_id"]
-
-        results.append(result_entry)
-
-        if result["success"]:
-            print("OK")
-            succeeded += 1
-        else:
-            print(f"FAILED: {result['error']}")
-            failed += 1
+            "caption": caption,
+            "hashtags": hashtags,
+            "video_path": video_paths.get(vid, ""),
+            "s3_url": video_urls.get(vid, ""),
+        })
 
-        # Save after each post (so progress is preserved on crash)
-        with open(results_path, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2)
+    if dry_run:
+        print("\n=== DRY RUN COMPLETE ===")
+        return
 
-        # Delay between posts
-        if i < len(schedule) - 1:
-            time.sleep(POST_DELAY)
+    # Each platform posts its own entries in schedule order on a worker thread;
+    # this thread logs results as they arrive (so progress is preserved on crash).
+    results = list(existing_results)
+    succeeded = 0
+    failed = 0
+    done = queue.Queue()
+
+    with open(log_path, "a", encoding="utf-8") as log_file, \
+         ThreadPoolExecutor(max_workers=max(1, len(jobs_by_platform))) as executor:
+        futures = [
+            executor.submit(post_platform, jobs, done,
+                            min(parallel, PLATFORM_MAX_IN_FLIGHT.get(platform, parallel)))
+            for platform, jobs in jobs_by_platform.items()
+        ]
+        running = len(futures)
+        while running:
+            item = done.get()
+            if item is None:
+                running -= 1
+                continue
+
+            job, result_entry = item
+            results.append(result_entry)
+            log_file.write(dumps_line(result_entry) + "\n")
+            log_file.flush()
+
+            if result_entry["success"]:
+                print(f"  {job['label']} {job['video_id']} → {job['platform']} OK")
+                succeeded += 1
+            else:
+                print(f"  {job['label']} {job['video_id']} → {job['platform']} "
+                      f"FAILED: {result_entry['error']}")
+                failed += 1
+
+        # Re-raise anything a worker died on
+        for future in futures:
+            future.result()
+
+    # Consolidate into the indented results file, then drop the log
+    write_json_atomic(results_path, results)
+    log_path.unlink()
 
     # Final summary
-    print(f"\n{'=== DRY RUN COMPLETE ===' if dry_run else '=== Posting complete ==='}")
-    if not dry_run:
-        print(f"  Succeeded: {succeeded}")
-        print(f"  Failed: {failed}")
-        print(f"  Skipped: {skipped}")
-        print(f"  Results: {results_path}")
+    print("\n=== Posting complete ===")
+    print(f"  Succeeded: {succeeded}")
+    print(f"  Failed: {failed}")
+    print(f"  Skipped: {skipped}")
+    print(f"  Results: {results_path}")
 
-        if failed > 0:
-            sys.exit(1)
+    if failed > 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,19 +1,34 @@
 """
 generate_posting_plan.py — Generate platform-tailored captions, hashtags, and a posting schedule.
 
-Reads .tmp/video_metadata.json and brand_config.json, calls OpenAI GPT-4o,
-and writes the final posting plan to .tmp/posting_plan.json.
+Reads .tmp/video_metadata.json and brand_config.json, calls OpenAI (gpt-4o-mini
+by default, structured outputs), and writes the final posting plan to .tmp/posting_plan.json.
 
 Usage:
     python tools/generate_posting_plan.py
 """
 
+import hashlib
 import json
 import sys
 
 from openai import OpenAI
 
-from config import OPENAI_API_KEY, TMP_DIR, load_brand_config
+from _json_common import dumps_indented, read_json, write_json, write_json_atomic
+from config import (
+    OPENAI_API_KEY, PLAN_CACHE, PLAN_CACHE_DIR, POSTING_PLAN_MODEL, TMP_DIR, load_brand_config,
+)
+
+MODEL = POSTING_PLAN_MODEL
+
+# Platform limits checked by validate_plan (mirrors the rules in SYSTEM_PROMPT)
+HASHTAG_LIMITS = {"instagram": (5, 12), "tiktok": (3, 6), "facebook": (3, 8)}
+IG_CAPTION_MAX = 2200
+
+# Max videos per OpenAI request. Typical batches (videos_per_batch=15) fit in a
+# single completion; larger ones are split so each response stays well inside
+# the output-token limit.
+PLAN_CHUNK_SIZE = 20
 
 SYSTEM_PROMPT = """\
 You are a social video publishing assistant.
@@ -79,14 +94,64 @@ Required JSON output schema
       "Confirm final approval is recorded before publish"
     ]
   }
+}"""
+
+
+def _obj(**properties) -> dict:
+    """Strict-mode object: every property required, nothing extra allowed."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def _hashtags(platform: str) -> dict:
+    low, high = HASHTAG_LIMITS[platform]
+    return {"type": "array", "items": {"type": "string"}, "minItems": low, "maxItems": high}
+
+
+_STR = {"type": "string"}
+
+# SYSTEM_PROMPT's output schema, enforced by the API. Strict mode has no string
+# maxLength, so the Instagram caption limit is still checked in validate_plan.
+PLAN_SCHEMA = _obj(
+    batch_summary=_obj(overall_theme=_STR, tone_notes=_STR),
+    items={"type": "array", "items": _obj(
+        video_id=_STR,
+        instagram=_obj(title=_STR, caption=_STR, hashtags=_hashtags("instagram")),
+        tiktok=_obj(caption=_STR, hashtags=_hashtags("tiktok")),
+        facebook=_obj(caption=_STR, hashtags=_hashtags("facebook")),
+    )},
+    posting_plan=_obj(
+        strategy=_STR,
+        recommended_schedule={"type": "array", "items": _obj(
+            video_id=_STR,
+            platform={"type": "string", "enum": ["instagram", "tiktok", "facebook"]},
+            publish_time_local=_STR,
+            notes=_STR,
+        )},
+        compliance_checks={"type": "array", "items": _STR},
+    ),
+)
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "posting_plan", "strict": True, "schema": PLAN_SCHEMA},
 }
 
-Now generate the JSON."""
 
+def build_system_prompt(brand: dict) -> str:
+    """
+    Build the system message: the fixed instructions followed by the brand inputs.
 
-def build_user_message(brand: dict, videos: list[dict]) -> str:
-    """Build the user message with brand config and video metadata filled in."""
+    Everything here is stable across runs with the same brand config, so it forms
+    an identical prompt prefix that OpenAI's automatic prompt caching can reuse.
+    """
     lines = [
+        SYSTEM_PROMPT,
+        "",
         "Inputs",
         f"Brand voice: {brand.get('brand_voice', 'not specified')}",
         f"Audience: {brand.get('audience', 'not specified')}",
@@ -94,21 +159,36 @@ def build_user_message(brand: dict, videos: list[dict]) -> str:
         f"Call to action style: {brand.get('cta_style', 'not specified')}",
         f"Hashtag style: {brand.get('hashtag_style', 'not specified')}",
         f"Banned words or topics: {brand.get('banned_list', 'none')}",
-        "",
-        f"Videos (batch of {len(videos)}):",
-        json.dumps(videos, indent=2),
-        "",
         f"Timezone for scheduling: {brand.get('timezone', 'America/New_York')}",
         f"Posts per day: {brand.get('posts_per_day', 3)}",
         f"Start date: {brand.get('start_date', 'auto')}",
-        "",
-        "Now generate the JSON.",
     ]
     return "\n".join(lines)
 
 
+def build_user_message(videos: list[dict], schedule_after: str | None = None) -> str:
+    """
+    Build the user message: only the per-run video metadata.
+
+    schedule_after is the last publish time already taken by an earlier chunk
+    of the same batch; the new schedule must start after it.
+    """
+    lines = [
+        f"Videos (batch of {len(videos)}):",
+        dumps_indented(videos),
+    ]
+    if schedule_after:
+        lines += [
+            "",
+            f"Earlier videos in this batch are already scheduled up to {schedule_after}. "
+            "Schedule these videos after that time, keeping the same posts-per-day pace.",
+        ]
+    lines += ["", "Now generate the JSON."]
+    return "\n".join(lines)
+
+
 def call_openai(system: str, user: str) -> dict:
-    """Call OpenAI GPT-4o with JSON mode and return parsed dict."""
+    """Call OpenAI with the PLAN_SCHEMA structured output and return parsed dict."""
     if not OPENAI_API_KEY:
         print("ERROR: OPENAI_API_KEY not set in .env")
         print("Add your key: OPENAI_API_KEY=sk-...")
@@ -116,10 +196,10 @@ def call_openai(system: str, user: str) -> dict:
 
     client = OpenAI(api_key=OPENAI_API_KEY)
 
-    print("Calling OpenAI GPT-4o...")
+    print(f"Calling OpenAI {MODEL}...")
     response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={"type": "json_object"},
+        model=MODEL,
+        response_format=RESPONSE_FORMAT,
         messages=[
             {"role": "system", "content": system},
             {"role": "user", "content": user},
@@ -127,13 +207,106 @@ def call_openai(system: str, user: str) -> dict:
         temperature=0.7,
     )
 
-    content = response.choices[0].message.content
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        print(f"ERROR: OpenAI refused to generate the plan: {message.refusal}")
+        sys.exit(1)
+
+    content = message.content
     tokens = response.usage
     print(f"Tokens used — prompt: {tokens.prompt_tokens}, completion: {tokens.completion_tokens}")
 
     return json.loads(content)
 
 
+def plan_cache_key(system: str, user: str) -> str:
+    """Content hash of everything that determines the completion."""
+    payload = json.dumps(
+        {"model": MODEL, "response_format": RESPONSE_FORMAT, "system": system, "user": user},
+        sort_keys=True,
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def cached_call_openai(system: str, user: str) -> dict:
+    """call_openai(), served from .tmp/plan_cache/ when PLAN_CACHE=1 and the prompt is unchanged."""
+    if not PLAN_CACHE:
+        return call_openai(system, user)
+
+    cache_path = PLAN_CACHE_DIR / f"{plan_cache_key(system, user)}.json"
+    if cache_path.exists():
+        print(f"Using cached OpenAI response ({cache_path.name})")
+        return read_json(cache_path)
+
+    plan = call_openai(system, user)
+
+    PLAN_CACHE_DIR.mkdir(exist_ok=True)
+    write_json_atomic(cache_path, plan)
+    return plan
+
+
+def merge_plans(plans: list[dict]) -> dict:
+    """Merge per-chunk plans into one: items keyed by video_id, schedules concatenated."""
+    merged = dict(plans[0])
+    items_by_id = {}
+    schedule = []
+    for part in plans:
+        for item in part.get("items", []):
+            items_by_id[item.get("video_id")] = item
+        schedule.extend(part.get("posting_plan", {}).get("recommended_schedule", []))
+    merged["items"] = list(items_by_id.values())
+    merged["posting_plan"] = {**plans[0].get("posting_plan", {}), "recommended_schedule": schedule}
+    return merged
+
+
+REQUIRED_BRAND_FIELDS = ("brand_voice", "audience", "niche")
+
+
+def _validate_brand(brand: dict) -> list[str]:
+    """Structural checks on brand_config.json. Returns list of errors."""
+    errors = []
+    for key in REQUIRED_BRAND_FIELDS:
+        value = brand.get(key)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f"brand_config.json: '{key}' must be a non-empty string")
+
+    posts_per_day = brand.get("posts_per_day", 3)
+    if isinstance(posts_per_day, bool) or not isinstance(posts_per_day, int) or posts_per_day < 1:
+        errors.append(f"brand_config.json: 'posts_per_day' must be a positive integer, got {posts_per_day!r}")
+
+    for key in ("cta_style", "hashtag_style", "banned_list", "timezone", "start_date"):
+        if key in brand and not isinstance(brand[key], str):
+            errors.append(f"brand_config.json: '{key}' must be a string")
+    return errors
+
+
+def _validate_videos(videos) -> list[str]:
+    """Structural checks on video_metadata.json. Returns list of errors."""
+    if not isinstance(videos, list):
+        return ["video_metadata.json: expected a list of videos"]
+
+    errors = []
+    seen = set()
+    for n, video in enumerate(videos):
+        if not isinstance(video, dict):
+            errors.append(f"video_metadata.json: entry {n} is not an object")
+            continue
+        vid = video.get("video_id")
+        if not isinstance(vid, str) or not vid:
+            errors.append(f"video_metadata.json: entry {n} has no video_id")
+        elif vid in seen:
+            errors.append(f"video_metadata.json: duplicate video_id {vid}")
+        else:
+            seen.add(vid)
+        if not isinstance(video.get("file_name"), str) or not video.get("file_name"):
+            errors.append(f"video_metadata.json: {vid or n} has no file_name")
+        # None means ffprobe was unavailable — allowed
+        duration = video.get("duration_seconds")
+        if duration is not None and (isinstance(duration, bool) or not isinstance(duration, (int, float))):
+            errors.append(f"video_metadata.json: {vid or n} has non-numeric duration_seconds")
+    return errors
+
+
 def validate_plan(plan: dict, video_count: int) -> list[str]:
     """Run basic validation on the generated plan. Returns list of warnings."""
     warnings = []
@@ -144,34 +317,29 @@ def validate_plan(plan: dict, video_count: int) -> list[str]:
 
     for item in items:
         vid = item.get("video_id", "?")
-
-        # Check Instagram hashtag count
-        ig_tags = item.get("instagram", {}).get("hashtags", [])
-        if len(ig_tags) < 5 or len(ig_tags) > 12:
-            warnings.append(f"{vid}: Instagram has {len(ig_tags)} hashtags (expected 5-12)")
-
-        # Check TikTok hashtag count
-        tt_tags = item.get("tiktok", {}).get("hashtags", [])
-        if len(tt_tags) < 3 or len(tt_tags) > 6:
-            warnings.append(f"{vid}: TikTok has {len(tt_tags)} hashtags (expected 3-6)")
-
-        # Check Facebook hashtag count
-        fb_tags = item.get("facebook", {}).get("hashtags", [])
-        if len(fb_tags) < 3 or len(fb_tags) > 8:
-            warnings.append(f"{vid}: Facebook has {len(fb_tags)} hashtags (expected 3-8)")
+        ig = item.get("instagram", {})
+        tt = item.get("tiktok", {})
+        fb = item.get("facebook", {})
+
+        # Check hashtag counts per platform
+        for content, label, (low, high) in (
+            (ig, "Instagram", HASHTAG_LIMITS["instagram"]),
+            (tt, "TikTok", HASHTAG_LIMITS["tiktok"]),
+            (fb, "Facebook", HASHTAG_LIMITS["facebook"]),
+        ):
+            n_tags = len(content.get("hashtags", []))
+            if n_tags < low or n_tags > high:
+                warnings.append(f"{vid}: {label} has {n_tags} hashtags (expected {low}-{high})")
 
         # Check Instagram caption length
-        ig_caption = item.get("instagram", {}).get("caption", "")
-        if len(ig_caption) > 2200:
-            warnings.append(f"{vid}: Instagram caption is {len(ig_caption)} chars (max 2200)")
-
-        # Check captions are different across platforms
-        captions = [
-            item.get("instagram", {}).get("caption", ""),
-            item.get("tiktok", {}).get("caption", ""),
-            item.get("facebook", {}).get("caption", ""),
-        ]
-        if len(set(captions)) < 3:
+        ig_caption = ig.get("caption", "")
+        if len(ig_caption) > IG_CAPTION_MAX:
+            warnings.append(f"{vid}: Instagram caption is {len(ig_caption)} chars (max {IG_CAPTION_MAX})")
+
+        # Check captions are different across platforms (blank ones aren't duplicates)
+        tt_caption = tt.get("caption", "")
+        fb_caption = fb.get("caption", "")
+        if (ig_caption and ig_caption in (tt_caption, fb_caption)) or (tt_caption and tt_caption == fb_caption):
             warnings.append(f"{vid}: Duplicate captions detected across platforms")
 
     # Check schedule exists
@@ -180,9 +348,16 @@ def validate_plan(plan: dict, video_count: int) -> list[str]:
         warnings.append("No posting schedule generated")
 
     # Check for same-minute posts
-    times = [entry.get("publish_time_local", "") for entry in schedule]
-    if len(times) != len(set(times)):
-        warnings.append("Schedule has duplicate publish times")
+    seen_times = set()
+    dup_times = set()
+    for entry in schedule:
+        t = entry.get("publish_time_local", "")
+        if t in seen_times:
+            dup_times.add(t)
+        elif t:
+            seen_times.add(t)
+    if dup_times:
+        warnings.append(f"Schedule has duplicate publish times: {', '.join(sorted(dup_times))}")
 
     return warnings
 
@@ -194,8 +369,7 @@ def main():
         print(f"ERROR: {metadata_path} not found. Run scan_videos.py first.")
         sys.exit(1)
 
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        videos = json.load(f)
+    videos = read_json(metadata_path)
 
     if not videos:
         print("No videos in metadata. Nothing to generate.")
@@ -204,9 +378,31 @@ def main():
     # Load brand config
     brand = load_brand_config()
 
-    # Build prompt and call API
-    user_msg = build_user_message(brand, videos)
-    plan = call_openai(SYSTEM_PROMPT, user_msg)
+    # Fail fast on malformed inputs — before any OpenAI call or cache lookup
+    errors = _validate_brand(brand) + _validate_videos(videos)
+    if errors:
+        print(f"ERROR: invalid inputs ({len(errors)}):")
+        for e in errors:
+            print(f"  - {e}")
+        sys.exit(2)
+
+    # Build prompt and call API — one request per chunk, each covering many videos.
+    # The system message is the same for every chunk (and every run with this brand
+    # config); only the user message changes.
+    system_msg = build_system_prompt(brand)
+    chunks = [videos[i:i + PLAN_CHUNK_SIZE] for i in range(0, len(videos), PLAN_CHUNK_SIZE)]
+    plans = []
+    schedule_after = None
+    for n, chunk in enumerate(chunks, start=1):
+        if len(chunks) > 1:
+            print(f"Chunk {n}/{len(chunks)} ({len(chunk)} videos)")
+        user_msg = build_user_message(chunk, schedule_after)
+        part = cached_call_openai(system_msg, user_msg)
+        plans.append(part)
+        times = [e.get("publish_time_local", "") for e in
+                 part.get("posting_plan", {}).get("recommended_schedule", [])]
+        schedule_after = max(times, default=None) or schedule_after
+    plan = merge_plans(plans)
 
     # Validate
     warnings = validate_plan(plan, len(videos))
@@ -219,8 +415,7 @@ def main():
 
     # Save output
     out_path = TMP_DIR / "posting_plan.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(plan, f, indent=2)
+    write_json(out_path, plan)
 
     print(f"\nPosting plan written to {out_path}")
     print(f"Videos: {len(plan.get('items', []))}")
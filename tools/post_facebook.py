@@ -12,15 +12,15 @@ import os
 import sys
 import time
 
-import requests
-
 from config import FACEBOOK_PAGE_ID, FACEBOOK_PAGE_ACCESS_TOKEN
+from _posting_common import FileChunks, build_session, format_tags, poll_delay
 
 GRAPH_API = "https://graph.facebook.com/v22.0"
 RUPLOAD_API = "https://rupload.facebook.com/video-upload/v22.0"
-POLL_INTERVAL = 5      # seconds between status checks
 POLL_TIMEOUT = 300     # max seconds to wait for processing
 
+SESSION = build_session()
+
 
 def post_reel(video_path: str, caption: str, hashtags: list[str]) -> dict:
     """
@@ -38,18 +38,19 @@ def post_reel(video_path: str, caption: str, hashtags: list[str]) -> dict:
         return {"success": False, "platform": "facebook",
                 "error": "FACEBOOK_PAGE_ID and FACEBOOK_PAGE_ACCESS_TOKEN must be set in .env"}
 
-    if not os.path.exists(video_path):
+    # One stat gives both the existence check and the size sent in the upload headers
+    try:
+        file_size = os.stat(video_path).st_size
+    except FileNotFoundError:
         return {"success": False, "platform": "facebook",
                 "error": f"Video file not found: {video_path}"}
 
-    file_size = os.path.getsize(video_path)
-
     # Build full caption with hashtags
-    tag_str = " ".join(f"#{t.lstrip('#')}" for t in hashtags)
+    tag_str = format_tags(hashtags)
     full_caption = f"{caption}\n\n{tag_str}".strip()
 
     # Step 1: Initialize upload
-    init_resp = requests.post(
+    init_resp = SESSION.post(
         f"{GRAPH_API}/{FACEBOOK_PAGE_ID}/video_reels",
         params={
             "upload_phase": "start",
@@ -67,24 +68,23 @@ def post_reel(video_path: str, caption: str, hashtags: list[str]) -> dict:
                 "error": f"No video_id returned: {init_resp.json()}"}
 
     # Step 2: Upload video binary (streamed — avoids loading entire file into RAM)
-    with open(video_path, "rb") as f:
-        upload_resp = requests.post(
-            f"{RUPLOAD_API}/{video_id}",
-            headers={
-                "Authorization": f"OAuth {FACEBOOK_PAGE_ACCESS_TOKEN}",
-                "offset": "0",
-                "file_size": str(file_size),
-                "Content-Type": "application/octet-stream",
-            },
-            data=f,
-        )
+    upload_resp = SESSION.post(
+        f"{RUPLOAD_API}/{video_id}",
+        headers={
+            "Authorization": f"OAuth {FACEBOOK_PAGE_ACCESS_TOKEN}",
+            "offset": "0",
+            "file_size": str(file_size),
+            "Content-Type": "application/octet-stream",
+        },
+        data=FileChunks(video_path, file_size),
+    )
 
     if upload_resp.status_code != 200:
         return {"success": False, "platform": "facebook",
                 "error": f"Upload failed: {upload_resp.text}"}
 
     # Step 3: Finish upload and publish
-    finish_resp = requests.post(
+    finish_resp = SESSION.post(
         f"{GRAPH_API}/{FACEBOOK_PAGE_ID}/video_reels",
         params={
             "upload_phase": "finish",
@@ -99,10 +99,19 @@ def post_reel(video_path: str, caption: str, hashtags: list[str]) -> dict:
         return {"success": False, "platform": "facebook",
                 "error": f"Finish/publish failed: {finish_resp.text}"}
 
-    # Step 4: Verify status
+    # A finish call that reports success is already published — no need to poll
+    try:
+        finished = finish_resp.json().get("success") is True
+    except ValueError:
+        finished = False
+    if finished:
+        return {"success": True, "platform": "facebook", "video_id": video_id}
+
+    # Step 4: Verify status (only when finish didn't confirm success)
     start = time.time()
+    attempt = 0
     while time.time() - start < POLL_TIMEOUT:
-        status_resp = requests.get(
+        status_resp = SESSION.get(
             f"{GRAPH_API}/{video_id}",
             params={
                 "fields": "status",
@@ -119,7 +128,8 @@ def post_reel(video_path: str, caption: str, hashtags: list[str]) -> dict:
                 return {"success": False, "platform": "facebook",
                         "error": f"Publishing error: {status}"}
 
-        time.sleep(POLL_INTERVAL)
+        time.sleep(poll_delay(attempt))
+        attempt += 1
 
     # If we get here, assume success since finish returned 200
     return {"success": True, "platform": "facebook", "video_id": video_id}
@@ -11,14 +11,14 @@ Usage (standalone test):
 import sys
 import time
 
-import requests
-
 from config import INSTAGRAM_USER_ID, INSTAGRAM_ACCESS_TOKEN
+from _posting_common import build_session, format_tags, poll_delay
 
 GRAPH_API = "https://graph.instagram.com"
-POLL_INTERVAL = 5      # seconds between status checks
 POLL_TIMEOUT = 300     # max seconds to wait for processing
 
+SESSION = build_session()
+
 
 def post_reel(video_url: str, caption: str, hashtags: list[str]) -> dict:
     """
@@ -37,11 +37,11 @@ def post_reel(video_url: str, caption: str, hashtags: list[str]) -> dict:
                 "error": "INSTAGRAM_USER_ID and INSTAGRAM_ACCESS_TOKEN must be set in .env"}
 
     # Build full caption with hashtags
-    tag_str = " ".join(f"#{t.lstrip('#')}" for t in hashtags)
+    tag_str = format_tags(hashtags)
     full_caption = f"{caption}\n\n{tag_str}".strip()
 
     # Step 1: Create media container
-    resp = requests.post(
+    resp = SESSION.post(
         f"{GRAPH_API}/{INSTAGRAM_USER_ID}/media",
         params={
             "media_type": "REELS",
@@ -62,8 +62,9 @@ def post_reel(video_url: str, caption: str, hashtags: list[str]) -> dict:
 
     # Step 2: Poll until container is ready
     start = time.time()
+    attempt = 0
     while time.time() - start < POLL_TIMEOUT:
-        status_resp = requests.get(
+        status_resp = SESSION.get(
             f"{GRAPH_API}/{container_id}",
             params={
                 "fields": "status_code",
@@ -78,13 +79,14 @@ def post_reel(video_url: str, caption: str, hashtags: list[str]) -> dict:
             return {"success": False, "platform": "instagram",
                     "error": f"Container processing failed: {status_resp.json()}"}
 
-        time.sleep(POLL_INTERVAL)
+        time.sleep(poll_delay(attempt))
+        attempt += 1
     else:
         return {"success": False, "platform": "instagram",
                 "error": f"Container processing timed out after {POLL_TIMEOUT}s"}
 
     # Step 3: Publish
-    pub_resp = requests.post(
+    pub_resp = SESSION.post(
         f"{GRAPH_API}/{INSTAGRAM_USER_ID}/media_publish",
         params={
             "creation_id": container_id,
@@ -15,14 +15,14 @@ import os
 import sys
 import time
 
-import requests
-
 from config import TIKTOK_ACCESS_TOKEN
+from _posting_common import FileChunks, build_session, format_tags, poll_delay
 
 TIKTOK_API = "https://open.tiktokapis.com/v2"
-POLL_INTERVAL = 5      # seconds between status checks
 POLL_TIMEOUT = 300     # max seconds to wait for processing
 
+SESSION = build_session()
+
 
 def post_video(video_path: str, caption: str, hashtags: list[str]) -> dict:
     """
@@ -40,14 +40,15 @@ def post_video(video_path: str, caption: str, hashtags: list[str]) -> dict:
         return {"success": False, "platform": "tiktok",
                 "error": "TIKTOK_ACCESS_TOKEN must be set in .env"}
 
-    if not os.path.exists(video_path):
+    # One stat gives both the existence check and the size sent in the upload headers
+    try:
+        file_size = os.stat(video_path).st_size
+    except FileNotFoundError:
         return {"success": False, "platform": "tiktok",
                 "error": f"Video file not found: {video_path}"}
 
-    file_size = os.path.getsize(video_path)
-
     # Build full caption with hashtags
-    tag_str = " ".join(f"#{t.lstrip('#')}" for t in hashtags)
+    tag_str = format_tags(hashtags)
     full_caption = f"{caption} {tag_str}".strip()
 
     headers = {
@@ -69,7 +70,7 @@ def post_video(video_path: str, caption: str, hashtags: list[str]) -> dict:
         },
     }
 
-    init_resp = requests.post(
+    init_resp = SESSION.post(
         f"{TIKTOK_API}/post/publish/video/init/",
         headers=headers,
         json=init_body,
@@ -94,8 +95,8 @@ def post_video(video_path: str, caption: str, hashtags: list[str]) -> dict:
         "Content-Length": str(file_size),
     }
 
-    with open(video_path, "rb") as f:
-        upload_resp = requests.put(upload_url, headers=upload_headers, data=f)
+    upload_resp = SESSION.put(upload_url, headers=upload_headers,
+                              data=FileChunks(video_path, file_size))
 
     if upload_resp.status_code not in (200, 201):
         return {"success": False, "platform": "tiktok",
@@ -103,8 +104,9 @@ def post_video(video_path: str, caption: str, hashtags: list[str]) -> dict:
 
     # Step 3: Poll for completion
     start = time.time()
+    attempt = 0
     while time.time() - start < POLL_TIMEOUT:
-        status_resp = requests.post(
+        status_resp = SESSION.post(
             f"{TIKTOK_API}/post/publish/status/fetch/",
             headers=headers,
             json={"publish_id": publish_id},
@@ -121,7 +123,8 @@ def post_video(video_path: str, caption: str, hashtags: list[str]) -> dict:
                 return {"success": False, "platform": "tiktok",
                         "error": f"Publish failed: {fail_reason}"}
 
-        time.sleep(POLL_INTERVAL)
+        time.sleep(poll_delay(attempt))
+        attempt += 1
 
     return {"success": False, "platform": "tiktok",
             "error": f"Publish timed out after {POLL_TIMEOUT}s"}
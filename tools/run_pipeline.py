@@ -1,34 +1,68 @@
 """
 run_pipeline.py — Single entry point for the social video publishing pipeline.
 
-Runs all steps in order; stops if any step fails.
+Runs all steps in order, in this process (each tool's main() is imported and
+called, so the interpreter and shared modules load once); stops if any step fails.
+In a full run the S3 upload only needs the scan, so it runs as a subprocess
+alongside plan generation (--sequential runs the steps strictly one at a time).
 
 Usage:
     python tools/run_pipeline.py                # full pipeline (scan → generate → upload → post)
     python tools/run_pipeline.py --generate-only  # steps 1-2 only (review plan before posting)
     python tools/run_pipeline.py --post-only      # steps 3-4 only (after reviewing plan)
     python tools/run_pipeline.py --dry-run        # full pipeline but posting step is dry-run
+    python tools/run_pipeline.py --parallel=3     # passed to the posting step (posts in flight per platform)
+    python tools/run_pipeline.py --sequential     # full pipeline without overlapping upload and generate
 """
 
+import importlib
 import subprocess
 import sys
+import traceback
 from datetime import datetime
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 
 GENERATE_STEPS = [
-    {"label": "Scanning videos",           "script": "tools/scan_videos.py"},
-    {"label": "Generating posting plan",    "script": "tools/generate_posting_plan.py"},
+    {"label": "Scanning videos",           "module": "scan_videos"},
+    {"label": "Generating posting plan",    "module": "generate_posting_plan"},
 ]
 
 POST_STEPS = [
-    {"label": "Uploading videos to S3",     "script": "tools/upload_to_s3.py",     "skip_on_dry_run": True},
-    {"label": "Executing posting plan",     "script": "tools/execute_posting_plan.py", "skip_on_dry_run": False},
+    {"label": "Uploading videos to S3",     "module": "upload_to_s3",     "skip_on_dry_run": True},
+    {"label": "Executing posting plan",     "module": "execute_posting_plan", "skip_on_dry_run": False,
+     "takes_parallel": True},
 ]
 
 
-def run_steps(steps, dry_run=False):
+def run_step(step, args) -> int:
+    """Run a tool's main() in-process with `args` as its command line. Returns the exit code."""
+    module = importlib.import_module(step["module"])
+    saved_argv = sys.argv
+    sys.argv = [f"{step['module']}.py", *args]
+    try:
+        module.main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, flush=True)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = saved_argv
+        sys.stdout.flush()
+    return 0
+
+
+def stop_pipeline(i, step, returncode):
+    print(f"\nPipeline STOPPED at step {i} ({step['label']}). See error above.", flush=True)
+    sys.exit(returncode)
+
+
+def run_steps(steps, dry_run=False, parallel_args=()):
     """Run a list of pipeline steps sequentially."""
     for i, step in enumerate(steps, start=1):
         if dry_run and step.get("skip_on_dry_run"):
@@ -37,22 +71,60 @@ def run_steps(steps, dry_run=False):
 
         print(f"[Step {i}/{len(steps)}] {step['label']}...", flush=True)
 
-        cmd = [sys.executable, "-u", str(PROJECT_ROOT / step["script"])]
+        args = []
         if dry_run and not step.get("skip_on_dry_run"):
-            cmd.append("--dry-run")
+            args.append("--dry-run")
+        if step.get("takes_parallel"):
+            args.extend(parallel_args)
 
-        result = subprocess.run(cmd, cwd=str(PROJECT_ROOT))
-        if result.returncode != 0:
-            print(f"\nPipeline STOPPED at step {i} ({step['label']}). See error above.", flush=True)
-            sys.exit(result.returncode)
+        returncode = run_step(step, args)
+        if returncode != 0:
+            stop_pipeline(i, step, returncode)
         print(flush=True)
 
 
+def run_overlapped(parallel_args=()):
+    """
+    Full run: scan, then upload to S3 (subprocess) while generating the plan, then post.
+
+    The upload gets its own process so its argv and output don't collide with the
+    in-process generate step; both must succeed before posting starts.
+    """
+    scan, generate = GENERATE_STEPS
+    upload, execute = POST_STEPS
+
+    print(f"[Step 1/4] {scan['label']}...", flush=True)
+    returncode = run_step(scan, [])
+    if returncode != 0:
+        stop_pipeline(1, scan, returncode)
+    print(flush=True)
+
+    print(f"[Step 2/4] {generate['label']} (step 3, {upload['label']}, runs alongside)...", flush=True)
+    script = PROJECT_ROOT / "tools" / f"{upload['module']}.py"
+    background = subprocess.Popen([sys.executable, "-u", str(script)], cwd=str(PROJECT_ROOT))
+    returncode = run_step(generate, [])
+    if returncode != 0:
+        background.terminate()
+        background.wait()
+        stop_pipeline(2, generate, returncode)
+    returncode = background.wait()
+    if returncode != 0:
+        stop_pipeline(3, upload, returncode)
+    print(flush=True)
+
+    print(f"[Step 4/4] {execute['label']}...", flush=True)
+    returncode = run_step(execute, list(parallel_args))
+    if returncode != 0:
+        stop_pipeline(4, execute, returncode)
+
+
 def main():
     args = sys.argv[1:]
     generate_only = "--generate-only" in args
     post_only = "--post-only" in args
     dry_run = "--dry-run" in args
+    sequential = "--sequential" in args
+    parallel_args = [a for a in args if a.startswith("--parallel=")]
 
     print(f"=== Social Video Publishing Pipeline === {datetime.now().isoformat()}", flush=True)
 
@@ -67,12 +139,15 @@ def main():
         print("Review the plan, then run: python tools/run_pipeline.py --post-only", flush=True)
     elif post_only:
         print("Mode: post-only (steps 3-4)\n", flush=True)
-        run_steps(POST_STEPS, dry_run=dry_run)
+        run_steps(POST_STEPS, dry_run=dry_run, parallel_args=parallel_args)
     else:
         mode = "dry-run" if dry_run else "full"
         print(f"Mode: {mode} (all steps)\n", flush=True)
-        run_steps(GENERATE_STEPS)
-        run_steps(POST_STEPS, dry_run=dry_run)
+        if dry_run or sequential:
+            run_steps(GENERATE_STEPS)
+            run_steps(POST_STEPS, dry_run=dry_run, parallel_args=parallel_args)
+        else:
+            run_overlapped(parallel_args)
 
     print(f"\n=== Pipeline complete === {datetime.now().isoformat()}", flush=True)
 
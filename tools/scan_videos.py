@@ -7,17 +7,171 @@ Usage:
     python tools/scan_videos.py
 """
 
+import itertools
 import json
+import math
+import os
 import random
+import struct
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from _json_common import JSONDecodeError, read_json, write_json, write_json_atomic
 from config import VIDEOS_DIR, TMP_DIR, VIDEO_EXTENSIONS, load_brand_config
 
+# Lowercased suffixes for a single str.endswith per directory entry
+_EXT_TUPLE = tuple(ext.lower() for ext in VIDEO_EXTENSIONS)
+
+PROBE_WORKERS = 8  # concurrent duration probes (ffprobe fallbacks are subprocess-wait bound)
+
+MP4_EXTENSIONS = (".mp4", ".mov", ".m4v")
+MATROSKA_EXTENSIONS = (".mkv", ".webm")
+
+# Matroska element IDs (marker bits included, as they appear in the file)
+_EBML_HEADER = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_CLUSTER = 0x1F43B675
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+
+
+def _mp4_boxes(f, start: int, end: int):
+    """Yield (type, payload_start, box_end) for each ISO-BMFF box in [start, end)."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:  # 64-bit largesize follows the type
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:  # box runs to the end of its container
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _duration_from_mp4(path) -> float | None:
+    """Read moov/mvhd. Boxes are skipped by seeking, so mdat is never read."""
+    with open(path, "rb") as f:
+        file_end = os.fstat(f.fileno()).st_size
+        for box_type, start, end in _mp4_boxes(f, 0, file_end):
+            if box_type != b"moov":
+                continue
+            for child, child_start, _ in _mp4_boxes(f, start, end):
+                if child != b"mvhd":
+                    continue
+                f.seek(child_start)
+                version = f.read(4)[0]  # version byte + 24-bit flags
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                    unknown = 0xFFFFFFFFFFFFFFFF
+                else:
+                    _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                    unknown = 0xFFFFFFFF
+                # Fragmented files leave mvhd duration at 0; let ffprobe handle them
+                if not timescale or not duration or duration == unknown:
+                    return None
+                return duration / timescale
+            return None
+    return None
+
+
+def _read_vint(f, keep_marker: bool = False) -> tuple[int, int]:
+    """Read an EBML variable-length integer. Returns (value, length in bytes)."""
+    first = f.read(1)
+    if not first:
+        raise EOFError("truncated EBML element")
+    length = 9 - first[0].bit_length()
+    if length > 8:
+        raise ValueError("invalid EBML variable-length integer")
+    rest = f.read(length - 1)
+    if len(rest) != length - 1:
+        raise EOFError("truncated EBML element")
+    value = first[0] if keep_marker else first[0] & (0xFF >> length)
+    for byte in rest:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _ebml_element(f) -> tuple[int, int, int | None]:
+    """Read an element header. Returns (id, data_start, size); size None = unknown."""
+    elem_id, _ = _read_vint(f, keep_marker=True)
+    size, length = _read_vint(f)
+    if size == (1 << (7 * length)) - 1:
+        size = None
+    return elem_id, f.tell(), size
+
+
+def _duration_from_matroska(path) -> float | None:
+    """Read Segment/Info/Duration (scaled by TimecodeScale) from an MKV/WebM file."""
+    with open(path, "rb") as f:
+        file_end = os.fstat(f.fileno()).st_size
+        elem_id, start, size = _ebml_element(f)
+        if elem_id != _EBML_HEADER or size is None:
+            return None
+        f.seek(start + size)
+        elem_id, start, size = _ebml_element(f)
+        if elem_id != _SEGMENT:
+            return None
+        segment_end = file_end if size is None else min(start + size, file_end)
+
+        # Info precedes the first Cluster in practice; anything else goes to ffprobe
+        while f.tell() < segment_end:
+            elem_id, start, size = _ebml_element(f)
+            if elem_id == _CLUSTER or size is None:
+                return None
+            if elem_id != _INFO:
+                f.seek(start + size)
+                continue
+
+            timecode_scale = 1_000_000  # default: 1 ms per tick
+            duration = None
+            info_end = start + size
+            while f.tell() < info_end:
+                elem_id, start, size = _ebml_element(f)
+                if size is None:
+                    return None
+                data = f.read(size)
+                if elem_id == _TIMECODE_SCALE:
+                    timecode_scale = int.from_bytes(data, "big")
+                elif elem_id == _DURATION:
+                    duration = struct.unpack(">f" if size == 4 else ">d", data)[0]
+            if not duration:
+                return None
+            return duration * timecode_scale / 1e9
+    return None
+
+
+def _duration_from_container(file_path) -> float | None:
+    """Duration from the container header, or None if unsupported/unreadable."""
+    ext = os.path.splitext(str(file_path))[1].lower()
+    try:
+        if ext in MP4_EXTENSIONS:
+            return _duration_from_mp4(file_path)
+        if ext in MATROSKA_EXTENSIONS:
+            return _duration_from_matroska(file_path)
+    except (OSError, EOFError, ValueError, IndexError, struct.error):
+        pass
+    return None
+
+
+def get_duration(file_path: str | Path) -> float | None:
+    """
+    Get video duration in seconds. Returns None if unavailable.
+
+    MP4/MOV and MKV/WebM durations are read straight from the container header;
+    other formats (and files the parser can't read) fall back to ffprobe.
+    """
+    duration = _duration_from_container(file_path)
+    if duration is not None:
+        return round(duration, 1)
 
-def get_duration(file_path: Path) -> float | None:
-    """Try to get video duration in seconds via ffprobe. Returns None if unavailable."""
     try:
         result = subprocess.run(
             [
@@ -38,58 +192,133 @@ def get_duration(file_path: Path) -> float | None:
     return None
 
 
-def scan_and_select() -> list[dict]:
-    """Scan videos/ folder and randomly select a batch."""
+def reservoir_sample(iterable, k: int, rng=random) -> tuple[list, int]:
+    """
+    Uniform random sample of k items from an iterable in one pass (Li's Algorithm L).
+
+    Holds only k items at a time. Returns (sample in random order, total item count).
+    """
+    def open_unit():  # uniform in (0, 1), so the logs below stay finite
+        u = rng.random()
+        while u == 0.0:
+            u = rng.random()
+        return u
+
+    it = iter(iterable)
+    reservoir = list(itertools.islice(it, k))
+    count = len(reservoir)
+    if count < k:
+        rng.shuffle(reservoir)
+        return reservoir, count
+    if k == 0:
+        return [], sum(1 for _ in it)
+
+    w = math.exp(math.log(open_unit()) / k)
+    next_index = count + math.floor(math.log(open_unit()) / math.log(1 - w))
+    for item in it:
+        if count == next_index:
+            reservoir[rng.randrange(k)] = item
+            w *= math.exp(math.log(open_unit()) / k)
+            next_index += math.floor(math.log(open_unit()) / math.log(1 - w)) + 1
+        count += 1
+    rng.shuffle(reservoir)
+    return reservoir, count
+
+
+def load_duration_cache(path: Path) -> dict:
+    """Read the {file_name: {size, mtime_ns, duration}} cache; empty if missing or corrupt."""
+    try:
+        cache = read_json(path)
+    except (OSError, JSONDecodeError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def scan_and_select(duration_cache: dict | None = None) -> list[dict]:
+    """
+    Scan videos/ folder and randomly select a batch.
+
+    duration_cache (from load_duration_cache) skips probing files whose size
+    and mtime are unchanged; it is updated in place with newly probed durations.
+    """
     brand = load_brand_config()
     batch_size = brand.get("videos_per_batch", 15)
 
-    # Find all video files
-    all_videos = [
-        f for f in VIDEOS_DIR.iterdir()
-        if f.is_file() and f.suffix.lower() in VIDEO_EXTENSIONS
-    ]
+    # Sample the batch while streaming a single directory pass, keeping only
+    # batch_size entries in memory; DirEntry caches the file type from readdir
+    # and the stat result after its first call.
+    with os.scandir(VIDEOS_DIR) as it:
+        selected, found = reservoir_sample(
+            (e for e in it
+             if e.name.lower().endswith(_EXT_TUPLE)
+             and e.is_file(follow_symlinks=False)),
+            batch_size,
+        )
 
-    if not all_videos:
+    if not found:
         print(f"No videos found in {VIDEOS_DIR}/")
         print(f"Drop .mp4/.mov/.avi/.mkv/.webm files there and re-run.")
         return []
 
-    print(f"Found {len(all_videos)} video(s) in {VIDEOS_DIR}/")
-
-    # Randomly select up to batch_size
-    selected = random.sample(all_videos, min(batch_size, len(all_videos)))
+    print(f"Found {found} video(s) in {VIDEOS_DIR}/")
     print(f"Selected {len(selected)} video(s) for this batch.")
+    if not selected:  # videos_per_batch is 0
+        return []
 
-    # Build metadata
-    metadata = []
-    for i, vf in enumerate(selected, start=1):
-        size_mb = round(vf.stat().st_size / (1024 * 1024), 1)
-        duration = get_duration(vf)
+    # Stat only the selected files, once each: the size, the cache check and
+    # the cache update all read from this result.
+    stats = [e.stat() for e in selected]
+    cache = duration_cache if duration_cache is not None else {}
 
-        metadata.append({
+    def cached_duration(entry, st):
+        hit = cache.get(entry.name)
+        if isinstance(hit, dict) and hit.get("size") == st.st_size and hit.get("mtime_ns") == st.st_mtime_ns:
+            return hit.get("duration")
+        return get_duration(entry.path)
+
+    # Probe durations concurrently; map() keeps results in selection order
+    with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(selected))) as pool:
+        durations = list(pool.map(cached_duration, selected, stats))
+
+    # Only real durations are cached, so a file ffprobe couldn't read is retried next run
+    for entry, st, duration in zip(selected, stats, durations):
+        if duration is not None:
+            cache[entry.name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "duration": duration}
+
+    # Build metadata in one pass. Plain dicts are what the JSON file and every
+    # later step consume, so there is no per-record class to convert from.
+    metadata = [
+        {
             "video_id": f"v{i:03d}",
-            "file_name": vf.name,
-            "file_size_mb": size_mb,
+            "file_name": entry.name,
+            "file_size_mb": round(st.st_size / (1024 * 1024), 1),
             "duration_seconds": duration,
             "topic": "",
             "transcript_optional": "",
             "notes_optional": "",
-        })
+        }
+        for i, (entry, st, duration) in enumerate(zip(selected, stats, durations), start=1)
+    ]
 
+    for video in metadata:
+        duration = video["duration_seconds"]
         dur_str = f"{duration}s" if duration else "unknown duration"
-        print(f"  {vf.name} ({size_mb} MB, {dur_str})")
+        print(f"  {video['file_name']} ({video['file_size_mb']} MB, {dur_str})")
 
     return metadata
 
 
 def main():
-    metadata = scan_and_select()
+    cache_path = TMP_DIR / "duration_cache.json"
+    duration_cache = load_duration_cache(cache_path)
+    metadata = scan_and_select(duration_cache)
     if not metadata:
         sys.exit(1)
 
     out_path = TMP_DIR / "video_metadata.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2)
+    write_json(out_path, metadata)
+
+    write_json_atomic(cache_path, duration_cache)
 
     print(f"\nVideo metadata written to {out_path}")
 
@@ -1,29 +1,75 @@
 """
 upload_to_s3.py — Upload batch videos to S3 for Instagram API access.
 
-Reads .tmp/video_metadata.json, uploads each video to S3 with public-read ACL,
-and writes .tmp/video_urls.json mapping video_id → public S3 URL.
+Reads .tmp/video_metadata.json, uploads each video to S3 with public-read ACL
+(UPLOAD_WORKERS files at a time), and writes .tmp/video_urls.json mapping
+video_id → public S3 URL, rewritten after every finished upload. Each finished
+file is also appended to .tmp/upload.log, which a re-run after a crash folds
+back in; the log is removed once a run completes.
 
 Usage:
     python tools/upload_to_s3.py
 """
 
-import json
+import base64
+import hashlib
 import mimetypes
+import mmap
+import os
+import string
 import sys
-from urllib.parse import quote
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from urllib.parse import quote as urllib_quote
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from _json_common import dumps_line, read_json, read_json_lines, write_json_atomic
 from config import (
-    AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_S3_BUCKET, AWS_S3_REGION,
+    AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_S3_ACCELERATE, AWS_S3_BUCKET, AWS_S3_REGION,
     TMP_DIR, VIDEOS_DIR,
 )
 
 
+S3_PREFIX = "videos/"
+
+# Multipart settings for upload_file: files over 16 MiB go up in 64 MiB parts,
+# up to 16 parts at a time, with UPLOAD_WORKERS files in flight (the client's
+# connection pool is sized to cover both)
+UPLOAD_WORKERS = 8
+PART_CONCURRENCY = 16
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=64 * 1024 * 1024,
+    max_concurrency=PART_CONCURRENCY,
+    use_threads=True,
+)
+
+# Percent-encoding table for ASCII keys: same output as urllib's quote(key, safe="/"),
+# but applied in one str.translate pass
+_S3_SAFE_CHARS = set(string.ascii_letters + string.digits + "_.-~/")
+_S3_TRANSLATE = {c: f"%{c:02X}" for c in range(128) if chr(c) not in _S3_SAFE_CHARS}
+
+
+def quote(key: str) -> str:
+    """URL-encode an S3 key for use in a public object URL."""
+    if key.isascii():
+        return key.translate(_S3_TRANSLATE)
+    return urllib_quote(key, safe="/")
+
+
 def get_s3_client():
-    """Create and return an S3 client."""
+    """
+    Create the S3 client for a run.
+
+    Build it once and share it: boto3 clients are thread-safe, and every upload
+    worker (and each worker's part threads) draws from this client's pool.
+    """
     if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY:
         print("ERROR: AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY must be set in .env")
         sys.exit(1)
@@ -36,20 +82,172 @@ def get_s3_client():
         region_name=AWS_S3_REGION,
         aws_access_key_id=AWS_ACCESS_KEY_ID,
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        config=Config(
+            max_pool_connections=UPLOAD_WORKERS * PART_CONCURRENCY,
+            # Adaptive mode rate-limits the client on throttling instead of
+            # letting every thread retry into the same 503 SlowDown
+            retries={"mode": "adaptive", "total_max_attempts": 5},
+            # Only add flexible checksums where S3 requires them: by default
+            # botocore streams put_object bodies as aws-chunked with a CRC32
+            # trailer, re-reading every file. Single-part puts carry
+            # ContentMD5 instead (see hash_and_upload).
+            request_checksum_calculation="when_required",
+            s3={"addressing_style": "virtual", "use_accelerate_endpoint": AWS_S3_ACCELERATE},
+            tcp_keepalive=True,
+        ),
     )
 
 
-def file_exists_on_s3(client, key: str) -> bool:
-    """Check if a file already exists in the S3 bucket."""
+def bucket_uses_kms(client) -> bool:
+    """
+    True if the bucket's default encryption is SSE-KMS (or DSSE-KMS).
+
+    Those objects' ETags are not MD5s of their content. Unreadable config (no
+    s3:GetEncryptionConfiguration permission) is treated as SSE-S3, whose
+    ETags are.
+    """
     try:
-        client.head_object(Bucket=AWS_S3_BUCKET, Key=key)
-        return True
+        config = client.get_bucket_encryption(Bucket=AWS_S3_BUCKET)["ServerSideEncryptionConfiguration"]
     except ClientError:
         return False
+    return any(
+        rule.get("ApplyServerSideEncryptionByDefault", {}).get("SSEAlgorithm", "").startswith("aws:kms")
+        for rule in config.get("Rules", [])
+    )
+
+
+def list_existing_objects(client, prefix: str = S3_PREFIX) -> dict[str, dict]:
+    """
+    Map key → {"etag", "size"} for every object under prefix.
+
+    One ListObjectsV2 request per 1000 keys replaces a HEAD per video. If listing
+    fails (e.g. no s3:ListBucket permission) nothing is treated as already uploaded.
+    On a KMS-encrypted bucket "etag" is None, since it can't be compared with a
+    local MD5; matches_s3_object then goes by size alone.
+    """
+    existing = {}
+    compare_etags = not bucket_uses_kms(client)
+    try:
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=AWS_S3_BUCKET, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                etag = obj["ETag"].strip('"') if compare_etags else None
+                existing[obj["Key"]] = {"etag": etag, "size": obj["Size"]}
+    except ClientError as e:
+        print(f"  WARNING: could not list s3://{AWS_S3_BUCKET}/{prefix} ({e}); uploading everything")
+        return {}
+    return existing
+
+
+def local_etag(file_path, part_size: int | None = None) -> str:
+    """
+    S3-style ETag of a local file, hashed from an mmap of it.
+
+    part_size=None gives the single-part form (plain MD5); otherwise the multipart
+    form md5(md5(part1) || md5(part2) || ...)-N.
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.md5(b"").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            if part_size is None:
+                return hashlib.md5(view).hexdigest()
+            digests = [hashlib.md5(view[i:i + part_size]).digest() for i in range(0, len(view), part_size)]
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def matches_s3_object(file_path, size: int, obj: dict) -> bool:
+    """
+    True if the S3 object (from list_existing_objects) holds the same bytes as the local file.
+
+    Where the ETag can't be an MD5 of the content, the matching size is the
+    best evidence available (the pre-ETag behaviour): objects on a KMS bucket
+    (etag None) and multipart uploads with another part size. Objects that
+    were individually written with SSE-C or SSE-KMS on an SSE-S3 bucket can't
+    be told apart in the listing; they never match and are re-uploaded.
+    """
+    if obj["size"] != size:
+        return False
+    etag = obj["etag"]
+    if etag is None:
+        return True
+    if "-" not in etag:
+        return local_etag(file_path) == etag
+    part_size = TRANSFER_CONFIG.multipart_chunksize
+    if etag.rsplit("-", 1)[1] != str(-(-size // part_size)):
+        # Uploaded with another part size, so the ETag can't be reproduced
+        return True
+    return local_etag(file_path, part_size) == etag
+
+
+def public_url(s3_key: str) -> str:
+    """
+    Public HTTPS URL of an object in the configured bucket.
+
+    Always the regional endpoint, even with AWS_S3_ACCELERATE: acceleration
+    speeds up our upload, while the platforms fetching the video gain nothing
+    from it and the accelerated GETs would be billed.
+    """
+    return f"https://{AWS_S3_BUCKET}.s3.{AWS_S3_REGION}.amazonaws.com/{quote(s3_key)}"
 
 
-def upload_video(client, file_path, s3_key: str) -> str:
-    """Upload a single video to S3 and return the public URL."""
+class ProgressPrinter:
+    """
+    Byte counter for the whole batch, drawn as one "\r"-rewritten status line.
+
+    Instances are passed as the Callback of upload_file, which calls them from
+    its part-upload threads, so the count is kept under a lock. The status
+    line is only drawn on a terminal (logs get the per-file lines alone) and
+    only when the percentage changes.
+    """
+
+    def __init__(self, total: int, stream=None):
+        self.total = total
+        self.stream = stream or sys.stdout
+        self.seen = 0
+        self._lock = threading.Lock()
+        self._shown = None
+        self._width = 0
+        self._live = self.stream.isatty()
+
+    def __call__(self, bytes_transferred: int):
+        with self._lock:
+            self.seen += bytes_transferred
+            pct = self.seen * 100 // self.total if self.total else 100
+            if self._live and pct != self._shown:
+                self._shown = pct
+                self._draw()
+
+    def line(self, msg: str):
+        """Print a permanent line above the status line."""
+        with self._lock:
+            if self._live:
+                self.stream.write("\r" + msg.ljust(self._width) + "\n")
+                self._draw()
+            else:
+                self.stream.write(msg + "\n")
+            self.stream.flush()
+
+    def finish(self):
+        """Leave the final status line in place before further output."""
+        with self._lock:
+            if self._live and self._width:
+                self.stream.write("\n")
+                self.stream.flush()
+
+    def _draw(self):
+        mb = 1024 * 1024
+        status = f"  [{self.seen / mb:.1f} / {self.total / mb:.1f} MB, {self._shown}%]"
+        self._width = max(self._width, len(status))
+        self.stream.write("\r" + status.ljust(self._width))
+        self.stream.flush()
+
+
+def upload_video(client, file_path, s3_key: str, progress=None) -> str:
+    """
+    Upload a single video to S3 with the managed (multipart) transfer and
+    return the public URL. Files under the threshold go through hash_and_upload.
+    """
     content_type = mimetypes.guess_type(str(file_path))[0] or "video/mp4"
 
     client.upload_file(
@@ -57,9 +255,72 @@ def upload_video(client, file_path, s3_key: str) -> str:
         AWS_S3_BUCKET,
         s3_key,
         ExtraArgs={"ContentType": content_type},
+        Config=TRANSFER_CONFIG,
+        Callback=progress,
     )
 
-    return f"https://{AWS_S3_BUCKET}.s3.{AWS_S3_REGION}.amazonaws.com/{quote(s3_key)}"
+    return public_url(s3_key)
+
+
+def hash_and_upload(client, file_path, s3_key: str, existing: dict | None,
+                    progress=None) -> tuple[str, bool]:
+    """
+    Single-part path for files under the multipart threshold.
+
+    The file is mapped once: the MD5 for the ETag check (and ContentMD5, so S3
+    verifies the body) and the put_object body both come from the same pages.
+    With the client's request_checksum_calculation="when_required" the mapping
+    is sent as-is with Content-Length; left at the default, botocore would wrap
+    it in aws-chunked encoding and read it again for a CRC32 trailer.
+    A plain put_object also skips the managed transfer's thread and queue setup.
+    This is as close to zero-copy as the client gets: TLS encrypts in user
+    space, so the bytes can't be sendfile()d straight to the socket.
+    """
+    content_type = mimetypes.guess_type(str(file_path))[0] or "video/mp4"
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        with (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else nullcontext(b"")) as body:
+            digest = hashlib.md5(body).digest()
+            if existing is not None and existing["size"] == size:
+                etag = existing["etag"]
+                if etag == digest.hex() or ((etag is None or "-" in etag)
+                                            and matches_s3_object(file_path, size, existing)):
+                    return public_url(s3_key), False
+            client.put_object(
+                Bucket=AWS_S3_BUCKET,
+                Key=s3_key,
+                Body=body,
+                ContentType=content_type,
+                ContentMD5=base64.b64encode(digest).decode("ascii"),
+            )
+    if progress is not None:
+        progress(size)  # put_object has no byte callback; count the file once sent
+    return public_url(s3_key), True
+
+
+def upload_if_changed(client, job: dict, progress=None) -> tuple[str, bool]:
+    """
+    Upload job["path"] unless S3 already holds the same bytes under job["key"].
+
+    Runs on the upload pool, so hashing one file overlaps other files' network
+    transfers. Bytes sent are reported to progress (a ProgressPrinter), if
+    given. Returns (public URL, whether an upload happened).
+    """
+    file_path, s3_key, size, existing = job["path"], job["key"], job["size"], job["existing"]
+    if size < TRANSFER_CONFIG.multipart_threshold:
+        return hash_and_upload(client, file_path, s3_key, existing, progress)
+    if existing is not None and matches_s3_object(file_path, size, existing):
+        return public_url(s3_key), False
+    return upload_video(client, file_path, s3_key, progress), True
+
+
+def load_upload_log(path) -> dict:
+    """video_id → URL from the JSON-lines log of an interrupted run (torn or incomplete records skipped)."""
+    return {
+        record["video_id"]: record["url"]
+        for record in read_json_lines(path)
+        if isinstance(record, dict) and "video_id" in record and "url" in record
+    }
 
 
 def main():
@@ -69,8 +330,7 @@ def main():
         print(f"ERROR: {metadata_path} not found. Run scan_videos.py first.")
         sys.exit(1)
 
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        videos = json.load(f)
+    videos = read_json(metadata_path)
 
     if not videos:
         print("No videos in metadata. Nothing to upload.")
@@ -80,55 +340,92 @@ def main():
     urls_path = TMP_DIR / "video_urls.json"
     existing_urls = {}
     if urls_path.exists():
-        with open(urls_path, "r", encoding="utf-8") as f:
-            existing_urls = json.load(f)
+        existing_urls = read_json(urls_path)
+    log_path = TMP_DIR / "upload.log"
+    existing_urls.update(load_upload_log(log_path))
 
     client = get_s3_client()
+    existing_objects = list_existing_objects(client)
     video_urls = dict(existing_urls)
     uploaded = 0
     skipped = 0
+    failed = 0
 
     print(f"Uploading {len(videos)} video(s) to S3 bucket '{AWS_S3_BUCKET}'...\n")
 
+    # Pre-pass: the already-uploaded lookup comes before any disk access, so
+    # only videos that still need work cost a stat (existence + size); the
+    # key/path are built once and the pool gets ready-to-run jobs
+    jobs = []
     for video in videos:
-        vid = video["video_id"]
         file_name = video["file_name"]
-        file_path = VIDEOS_DIR / file_name
-        s3_key = f"videos/{file_name}"
-
-        if not file_path.exists():
-            print(f"  SKIP {file_name} — file not found in videos/")
-            continue
-
-        # Skip if already uploaded
-        if vid in existing_urls:
+        if video["video_id"] in existing_urls:
             print(f"  SKIP {file_name} — already uploaded")
             skipped += 1
             continue
 
-        # Check S3 too
-        if file_exists_on_s3(client, s3_key):
-            url = f"https://{AWS_S3_BUCKET}.s3.{AWS_S3_REGION}.amazonaws.com/{s3_key}"
-            video_urls[vid] = url
-            print(f"  SKIP {file_name} — already on S3")
-            skipped += 1
+        file_path = VIDEOS_DIR / file_name
+        try:
+            size = file_path.stat().st_size
+        except FileNotFoundError:
+            print(f"  SKIP {file_name} — file not found in videos/")
             continue
 
-        size_mb = file_path.stat().st_size / (1024 * 1024)
-        print(f"  Uploading {file_name} ({size_mb:.1f} MB)...", end=" ", flush=True)
+        # The S3 check (same key and same bytes) runs on the upload pool
+        s3_key = f"{S3_PREFIX}{file_name}"
+        jobs.append({
+            "video_id": video["video_id"],
+            "file_name": file_name,
+            "path": file_path,
+            "key": s3_key,
+            "size": size,
+            "existing": existing_objects.get(s3_key),
+        })
 
-        url = upload_video(client, file_path, s3_key)
-        video_urls[vid] = url
-        uploaded += 1
-        print("done")
+    # Check/upload concurrently; each finished file is saved right away so a
+    # crash mid-batch keeps the URLs of everything already uploaded
+    if jobs:
+        progress = ProgressPrinter(total=sum(job["size"] for job in jobs))
+        with open(log_path, "a", encoding="utf-8") as log_file, \
+             ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(jobs))) as pool:
+            futures = {pool.submit(upload_if_changed, client, job, progress): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                vid, file_name = job["video_id"], job["file_name"]
+                try:
+                    url, did_upload = future.result()
+                except Exception as e:
+                    # One bad file must not cost the rest of the batch its URLs
+                    failed += 1
+                    progress.line(f"  FAILED {file_name} — {e}")
+                    continue
+                video_urls[vid] = url
+                log_file.write(dumps_line({
+                    "video_id": vid, "key": job["key"], "url": video_urls[vid],
+                    "ts": round(time.time(), 3),
+                }) + "\n")
+                log_file.flush()
+                write_json_atomic(urls_path, video_urls)
+                if did_upload:
+                    uploaded += 1
+                    progress.line(f"  Uploaded {file_name} ({job['size'] / (1024 * 1024):.1f} MB)")
+                else:
+                    skipped += 1
+                    progress(job["size"])  # nothing to send; still part of the total
+                    progress.line(f"  SKIP {file_name} — already on S3")
+        progress.finish()
 
-    # Save URLs
-    with open(urls_path, "w", encoding="utf-8") as f:
-        json.dump(video_urls, f, indent=2)
+    # Save URLs (covers runs where nothing needed checking); everything in
+    # the log is now in video_urls.json
+    write_json_atomic(urls_path, video_urls)
+    log_path.unlink(missing_ok=True)
 
-    print(f"\nS3 upload complete: {uploaded} uploaded, {skipped} skipped")
+    print(f"\nS3 upload complete: {uploaded} uploaded, {skipped} skipped, {failed} failed")
     print(f"Video URLs written to {urls_path}")
 
+    if failed > 0:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()